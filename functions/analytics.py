@@ -1,142 +1,237 @@
-import pytz  # Add this import at the top
-import json
 import boto3
+from boto3.dynamodb.conditions import Key
+from botocore.exceptions import ClientError
 import os
 import decimal
 from datetime import datetime
-from collections import defaultdict
+from zoneinfo import ZoneInfo
+from collections import Counter
 import logging
+import time
+import hashlib
+
+from common import boto_config, error_response, extract_context, to_json
 
 # Configure logging
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
-class DecimalEncoder(json.JSONEncoder):
-    def default(self, o):
-        if isinstance(o, decimal.Decimal):
-            return float(o) if o % 1 != 0 else int(o)
-        return super(DecimalEncoder, self).default(o)
+# India Standard Time, resolved once per container
+IST = ZoneInfo('Asia/Kolkata')
 
-dynamodb = boto3.resource('dynamodb')
+dynamodb = boto3.resource('dynamodb', config=boto_config)
 transactions_table = dynamodb.Table(os.environ['TRANSACTIONS_TABLE'])
 budgets_table = dynamodb.Table(os.environ['BUDGETS_TABLE'])
+totals_table = dynamodb.Table(os.environ['TOTALS_TABLE'])
+user_meta_table = dynamodb.Table(os.environ['USER_META_TABLE'])
+
+# How long after a write DateIndex may still be missing it; analyze_spending
+# sends no ETag inside this window so a stale result is never cached
+INDEX_SETTLE_SECONDS = 5
+
+# Give up on keys DynamoDB keeps leaving unprocessed well inside the Lambda timeout
+MAX_BATCH_ATTEMPTS = 5
+
+def query_all(table, **query_params):
+    """Run a query and follow LastEvaluatedKey until every page is read"""
+    items = []
+    while True:
+        response = table.query(**query_params)
+        items.extend(response.get('Items', []))
+        last_key = response.get('LastEvaluatedKey')
+        if not last_key:
+            return items
+        query_params['ExclusiveStartKey'] = last_key
+
+def batch_get_all(table, keys, **get_params):
+    """BatchGetItem every key, 100 at a time, retrying any unprocessed keys"""
+    items = []
+    for i in range(0, len(keys), 100):
+        request = {table.name: dict(get_params, Keys=keys[i:i + 100])}
+        attempt = 0
+        while request:
+            if attempt == MAX_BATCH_ATTEMPTS:
+                # Surfaces as a 429 so the client retries later
+                raise ClientError({
+                    'Error': {
+                        'Code': 'ProvisionedThroughputExceededException',
+                        'Message': f'Keys still unprocessed after {attempt} BatchGetItem attempts'
+                    }
+                }, 'BatchGetItem')
+            if attempt:
+                time.sleep(min(0.05 * 2 ** attempt, 1))
+            response = dynamodb.batch_get_item(RequestItems=request)
+            items.extend(response.get('Responses', {}).get(table.name, []))
+            request = response.get('UnprocessedKeys')
+            attempt += 1
+    return items
+
+def get_user_versions(user_id):
+    """Read the user's write counters, bumped whenever their data changes"""
+    return user_meta_table.get_item(
+        Key={'userId': user_id},
+        ProjectionExpression='txnVersion, budgetVersion, lastTxnAt',
+        ConsistentRead=True
+    ).get('Item', {})
+
+def compute_etag(*parts):
+    """Strong ETag over everything a response depends on"""
+    return '"%s"' % hashlib.sha1('|'.join(map(str, parts)).encode()).hexdigest()
+
+def etag_matches(event, etag):
+    """True if the request's If-None-Match already names this ETag"""
+    for name, value in (event.get('headers') or {}).items():
+        if name.lower() == 'if-none-match':
+            return etag in value
+    return False
+
+def not_modified(etag):
+    """304 response for a client whose cached copy is still current"""
+    return {
+        'statusCode': 304,
+        'headers': {'ETag': etag},
+        'body': ''
+    }
 
 def analyze_spending(event, context):
     """Analyze spending patterns by category and time period"""
-    logger.info("Starting analyze_spending with event: %s", json.dumps(event))
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Event: %s", to_json(event))
 
     try:
-        user_id = event['requestContext']['authorizer']['claims']['sub']
-        logger.info("Analyzing spending for user: %s", user_id)
+        ctx = extract_context(event)
+        logger.info("handler=%s requestId=%s user=%s", 'analyze_spending', ctx.request_id, ctx.user_id)
+
+        user_id = ctx.user_id
 
         params = event.get('queryStringParameters', {}) or {}
-        logger.debug("Query parameters: %s", json.dumps(params))
+        logger.debug("Query parameters: %s", params)
 
         # Update date handling to use IST
-        ist_timezone = pytz.timezone('Asia/Kolkata')
-        now = datetime.now(ist_timezone)
+        now = datetime.now(IST)
+        current_month = f'{now.year:04d}-{now.month:02d}'
 
         # Default to current month if no date range specified
-        start_date = params.get('startDate', now.strftime('%Y-%m-01'))
-        end_date = params.get('endDate', now.strftime('%Y-%m-%d'))
+        start_date = params.get('startDate', f'{current_month}-01')
+        end_date = params.get('endDate', now.date().isoformat())
         logger.info("Analyzing period from %s to %s (IST)", start_date, end_date)
 
-        # Query transactions
-        response = transactions_table.query(
-            KeyConditionExpression='userId = :uid',
-            FilterExpression='#dt BETWEEN :start AND :end',
-            ExpressionAttributeNames={'#dt': 'date'},
-            ExpressionAttributeValues={
-                ':uid': user_id,
-                ':start': start_date,
-                ':end': end_date
-            }
+        # The result only changes when the range or the user's transactions do
+        versions = get_user_versions(user_id)
+        etag = compute_etag(user_id, start_date, end_date, versions.get('txnVersion', 0))
+        if etag_matches(event, etag):
+            logger.info("Spending analysis unchanged, returning 304")
+            return not_modified(etag)
+
+        # The date index is only eventually consistent, so right after a write
+        # this result may not include it yet
+        last_txn_at = int(versions.get('lastTxnAt', 0)) / 1000
+        cacheable = time.time() - last_txn_at >= INDEX_SETTLE_SECONDS
+
+        # Query transactions in range via the date index
+        items = query_all(
+            transactions_table,
+            IndexName='DateIndex',
+            KeyConditionExpression=Key('userId').eq(user_id) & Key('date').between(start_date, end_date),
+            # Only category and amount are needed for the breakdown
+            ProjectionExpression='#c, #a',
+            ExpressionAttributeNames={'#c': 'category', '#a': 'amount'}
         )
 
-        transaction_count = len(response.get('Items', []))
+        transaction_count = len(items)
         logger.info("Retrieved %d transactions for analysis", transaction_count)
 
-        # Categorize spending
-        spending = defaultdict(float)
-        for item in response.get('Items', []):
-            spending[item['category']] += float(item['amount'])
+        # Categorize spending, keeping DynamoDB's Decimal amounts as-is
+        spending = Counter()
+        for item in items:
+            spending[item['category']] += item['amount']
 
         total_spent = sum(spending.values())
         logger.info("Total spending: %s, Categories analyzed: %d",
                    total_spent, len(spending))
-        logger.debug("Spending by category: %s", json.dumps(dict(spending)))
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Spending by category: %s", to_json(dict(spending)))
+
+        headers = {'Content-Type': 'application/json'}
+        if cacheable:
+            headers['ETag'] = etag
+        else:
+            logger.info("Latest transaction may not be indexed yet, omitting ETag")
 
         return {
             'statusCode': 200,
-            'headers': {'Content-Type': 'application/json'},
-            'body': json.dumps({
+            'headers': headers,
+            'body': to_json({
                 'startDate': start_date,
                 'endDate': end_date,
                 'spendingByCategory': dict(spending),
                 'totalSpent': total_spent
-            }, cls=DecimalEncoder)
+            })
         }
     except Exception as e:
-        logger.error("Error analyzing spending: %s", str(e), exc_info=True)
-        return {
-            'statusCode': 500,
-            'body': json.dumps({'error': str(e)})
-        }
+        return error_response(e, "Error analyzing spending")
 
 def budget_status(event, context):
     """Check current status of all budgets"""
-    logger.info("Starting budget_status with event: %s", json.dumps(event))
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Event: %s", to_json(event))
 
     try:
-        user_id = event['requestContext']['authorizer']['claims']['sub']
-        logger.info("Checking budget status for user: %s", user_id)
+        ctx = extract_context(event)
+        logger.info("handler=%s requestId=%s user=%s", 'budget_status', ctx.request_id, ctx.user_id)
+
+        user_id = ctx.user_id
 
-        # Get all budgets
-        budgets = budgets_table.query(
-            KeyConditionExpression='userId = :uid',
-            ExpressionAttributeValues={':uid': user_id}
-        ).get('Items', [])
+        # Current month in IST
+        now = datetime.now(IST)
+        current_month = f'{now.year:04d}-{now.month:02d}'
+        logger.info("Using month: %s (IST)", current_month)
+
+        # Status depends on the month, the user's budgets and their transactions
+        versions = get_user_versions(user_id)
+        etag = compute_etag(user_id, current_month,
+                            versions.get('txnVersion', 0), versions.get('budgetVersion', 0))
+        if etag_matches(event, etag):
+            logger.info("Budget status unchanged, returning 304")
+            return not_modified(etag)
+
+        # Get all budgets. Reads below are consistent so they are at least as
+        # new as the versions the ETag was computed from
+        budgets = query_all(
+            budgets_table,
+            KeyConditionExpression=Key('userId').eq(user_id),
+            ConsistentRead=True
+        )
 
         budget_count = len(budgets)
         logger.info("Retrieved %d budgets", budget_count)
 
-        # Get current month's transactions with IST timezone
-        ist_timezone = pytz.timezone('Asia/Kolkata')
-        now = datetime.now(ist_timezone)
-        start_of_month = now.strftime('%Y-%m-01')
-        end_of_month = now.strftime('%Y-%m-%d')
-
-        logger.info("Using date range: %s to %s (IST)", start_of_month, end_of_month)
-
-        transactions = transactions_table.query(
-            KeyConditionExpression='userId = :uid',
-            FilterExpression='#dt BETWEEN :start AND :end',
-            ExpressionAttributeNames={'#dt': 'date'},
-            ExpressionAttributeValues={
-                ':uid': user_id,
-                ':start': start_of_month,
-                ':end': end_of_month
-            }
-        ).get('Items', [])
-
-        transaction_count = len(transactions)
-        logger.info("Retrieved %d transactions for period %s to %s",
-                   transaction_count, start_of_month, end_of_month)
-
-        # Calculate spending per category
-        spending = defaultdict(decimal.Decimal)  # Use Decimal for precise calculations
-        for t in transactions:
-            amount = decimal.Decimal(str(t['amount']))  # Convert to Decimal safely
-            spending[t['category']] += amount
-
-        logger.debug("Monthly spending by category: %s",
-                    json.dumps(dict(spending), cls=DecimalEncoder))
+        # Fetch this month's totals for exactly the budgeted categories
+        totals = batch_get_all(
+            totals_table,
+            [{'userId': user_id, 'ymCat': f"{current_month}#{b['category']}"} for b in budgets],
+            ProjectionExpression='ymCat, #tot',
+            ExpressionAttributeNames={'#tot': 'total'},
+            ConsistentRead=True
+        )
+        logger.info("Retrieved %d category totals for month %s",
+                   len(totals), current_month)
+
+        # Spending per category, keyed by the category part of ymCat
+        spending = {
+            t['ymCat'].split('#', 1)[1]: t['total']
+            for t in totals
+        }
+
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Monthly spending by category: %s",
+                         to_json(dict(spending)))
 
         # Compare with budgets
         status = []
         for budget in budgets:
             category = budget['category']
-            limit = decimal.Decimal(str(budget['limit']))
+            limit = budget['limit']
             current = spending.get(category, decimal.Decimal('0'))
             percentage = (current / limit * 100) if limit > 0 else decimal.Decimal('0')
 
@@ -156,15 +251,11 @@ def budget_status(event, context):
 
         return {
             'statusCode': 200,
-            'headers': {'Content-Type': 'application/json'},
-            'body': json.dumps({
-                'month': now.strftime('%Y-%m'),
+            'headers': {'Content-Type': 'application/json', 'ETag': etag},
+            'body': to_json({
+                'month': current_month,
                 'budgetStatus': status
-            }, cls=DecimalEncoder)
+            })
         }
     except Exception as e:
-        logger.error("Error checking budget status: %s", str(e), exc_info=True)
-        return {
-            'statusCode': 500,
-            'body': json.dumps({'error': str(e)})
-        }
\ No newline at end of file
+        return error_response(e, "Error checking budget status")
@@ -1,58 +1,84 @@
 import json
 import boto3
+from boto3.dynamodb.conditions import Key
 import os
 import decimal
 from datetime import datetime
+from zoneinfo import ZoneInfo
 import logging
-import pytz
+
+from common import (bad_request, boto_config, error_response, extract_context, parse_amount,
+                    to_attribute_values, to_json)
 
 # Configure logging
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
-# Helper class for JSON serialization of Decimal types
-class DecimalEncoder(json.JSONEncoder):
-    def default(self, o):
-        if isinstance(o, decimal.Decimal):
-            return float(o) if o % 1 != 0 else int(o)
-        return super(DecimalEncoder, self).default(o)
+# India Standard Time, resolved once per container
+IST = ZoneInfo('Asia/Kolkata')
 
 # Initialize DynamoDB resource
-dynamodb = boto3.resource('dynamodb')
+dynamodb = boto3.resource('dynamodb', config=boto_config)
 budgets_table = dynamodb.Table(os.environ['BUDGETS_TABLE'])
+user_meta_table = dynamodb.Table(os.environ['USER_META_TABLE'])
 
 def create_budget(event, context):
     """Create or update a budget for a user"""
-    logger.info("Starting create_budget with event: %s", json.dumps(event))
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Event: %s", to_json(event))
 
     try:
-        # Parse request body
-        body = json.loads(event['body'])
-        logger.debug("Request body: %s", json.dumps(body))
+        ctx = extract_context(event)
+        logger.info("handler=%s requestId=%s user=%s", 'create_budget', ctx.request_id, ctx.user_id)
+
+        # Parse request body, reading numbers straight into Decimal
+        body = json.loads(event['body'], parse_float=decimal.Decimal, parse_int=decimal.Decimal)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Request body: %s", to_json(body))
 
-        # Get user ID from Cognito authorizer
-        user_id = event['requestContext']['authorizer']['claims']['sub']
-        logger.info("Processing budget for user: %s", user_id)
+        user_id = ctx.user_id
 
         category = body['category']
-        budget_limit = decimal.Decimal(str(body['limit']))
+        budget_limit = parse_amount(body.get('limit'))
+        if budget_limit is None:
+            return bad_request("'limit' must be a number")
         logger.info("Setting budget for category %s with limit %s", category, budget_limit)
 
         # Get current time in IST
-        ist_timezone = pytz.timezone('Asia/Kolkata')
-        now = datetime.now(ist_timezone)
+        now = datetime.now(IST)
+        timestamp = now.replace(microsecond=0).isoformat()
 
         budget = {
             'userId': user_id,
             'category': category,
             'limit': budget_limit,
-            'createdAt': now.strftime('%Y-%m-%dT%H:%M:%S%z'),
-            'updatedAt': now.strftime('%Y-%m-%dT%H:%M:%S%z')
+            'alertSent': {},  # Month (YYYY-MM) -> True once that month's alert has gone out
+            'createdAt': timestamp,
+            'updatedAt': timestamp
         }
-        logger.debug("Prepared budget item: %s", json.dumps(budget, cls=DecimalEncoder))
-
-        # Save to DynamoDB
-        budgets_table.put_item(Item=budget)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Prepared budget item: %s", to_json(budget))
+
+        # Save the budget and bump the user's budget version (so cached budget
+        # status goes stale) in one transaction: an error means neither happened
+        dynamodb.meta.client.transact_write_items(
+            TransactItems=[
+                {
+                    'Put': {
+                        'TableName': budgets_table.name,
+                        'Item': to_attribute_values(budget)
+                    }
+                },
+                {
+                    'Update': {
+                        'TableName': user_meta_table.name,
+                        'Key': to_attribute_values({'userId': user_id}),
+                        'UpdateExpression': 'ADD budgetVersion :one',
+                        'ExpressionAttributeValues': to_attribute_values({':one': 1})
+                    }
+                }
+            ]
+        )
         logger.info("Budget saved successfully for category: %s", category)
 
         return {
@@ -60,61 +86,44 @@ def create_budget(event, context):
             'headers': {
                 'Content-Type': 'application/json'
             },
-            'body': json.dumps({
+            'body': to_json({
                 'message': 'Budget created/updated successfully',
                 'category': category
-            }, cls=DecimalEncoder)
-        }
-    except Exception as e:
-        logger.error("Error creating budget: %s", str(e), exc_info=True)
-        return {
-            'statusCode': 500,
-            'body': json.dumps({
-                'error': f'Error creating budget: {str(e)}'
             })
         }
+    except Exception as e:
+        return error_response(e, "Error creating budget", f'Error creating budget: {str(e)}')
 
 def get_budgets(event, context):
     """Retrieve all budgets for a user"""
-    logger.info("Starting get_budgets with event: %s", json.dumps(event))
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Event: %s", to_json(event))
 
     try:
-        # Get user ID from Cognito authorizer
-        user_id = event['requestContext']['authorizer']['claims']['sub']
-        logger.info("Retrieving budgets for user: %s", user_id)
+        ctx = extract_context(event)
+        logger.info("handler=%s requestId=%s user=%s", 'get_budgets', ctx.request_id, ctx.user_id)
 
-        # If you have any date filtering, update it to use IST
-        ist_timezone = pytz.timezone('Asia/Kolkata')
-        now = datetime.now(ist_timezone)
-        current_month = now.strftime('%Y-%m')
+        user_id = ctx.user_id
 
         # Query budgets for user
         response = budgets_table.query(
-            KeyConditionExpression='userId = :uid',
-            ExpressionAttributeValues={
-                ':uid': user_id
-            }
+            KeyConditionExpression=Key('userId').eq(user_id)
         )
 
         item_count = len(response.get('Items', []))
         logger.info("Retrieved %d budgets for user", item_count)
-        logger.debug("Budget items: %s", json.dumps(response.get('Items', []), cls=DecimalEncoder))
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Budget items: %s", to_json(response.get('Items', [])))
 
         return {
             'statusCode': 200,
             'headers': {
                 'Content-Type': 'application/json'
             },
-            'body': json.dumps({
+            'body': to_json({
                 'budgets': response.get('Items', []),
                 'count': item_count
-            }, cls=DecimalEncoder)
+            })
         }
     except Exception as e:
-        logger.error("Error retrieving budgets: %s", str(e), exc_info=True)
-        return {
-            'statusCode': 500,
-            'body': json.dumps({
-                'error': f'Error retrieving budgets: {str(e)}'
-            })
-        }
\ No newline at end of file
+        return error_response(e, "Error retrieving budgets", f'Error retrieving budgets: {str(e)}')
@@ -0,0 +1,132 @@
+import orjson
+import decimal
+import re
+from datetime import date
+from collections import namedtuple
+from boto3.dynamodb.types import TypeSerializer
+from botocore.config import Config
+from botocore.exceptions import ClientError
+import logging
+
+logger = logging.getLogger()
+
+# Shared client config so warm invocations reuse pooled HTTPS connections
+boto_config = Config(
+    tcp_keepalive=True,
+    max_pool_connections=10,
+    retries={'mode': 'standard'}
+)
+
+# transact_write_items goes through the low-level client, which wants typed values
+serializer = TypeSerializer()
+
+def to_attribute_values(item):
+    """Serialize a plain dict into DynamoDB's typed attribute-value format"""
+    return {k: serializer.serialize(v) for k, v in item.items()}
+
+# Helpers for JSON serialization of Decimal types
+# orjson only serializes integers that fit in 64 bits
+INT64_MIN = -2 ** 63
+UINT64_MAX = 2 ** 64 - 1
+
+def decimal_default(o):
+    """orjson fallback for the Decimal values DynamoDB returns"""
+    if isinstance(o, decimal.Decimal):
+        if o == o.to_integral_value() and INT64_MIN <= o <= UINT64_MAX:
+            return int(o)
+        return float(o)
+    raise TypeError(f'Object of type {type(o).__name__} is not JSON serializable')
+
+def to_json(obj):
+    """Serialize obj to a JSON string"""
+    return orjson.dumps(obj, default=decimal_default).decode()
+
+# DynamoDB numbers: up to 38 significant digits, magnitudes from 1E-130 to below 1E+126
+DYNAMODB_MAX_DIGITS = 38
+DYNAMODB_MIN_EXPONENT = -130
+DYNAMODB_MAX_EXPONENT = 125
+
+def parse_amount(value):
+    """Decimal for a JSON number or numeric string, None for anything else"""
+    if isinstance(value, str):
+        try:
+            value = decimal.Decimal(value)
+        except decimal.InvalidOperation:
+            return None
+    # bool is not a Decimal, so JSON true/false are rejected here too
+    if not isinstance(value, decimal.Decimal) or not value.is_finite():
+        return None
+    # Anything DynamoDB can't store as a number would otherwise fail the write
+    if len(value.as_tuple().digits) > DYNAMODB_MAX_DIGITS:
+        return None
+    if value and not DYNAMODB_MIN_EXPONENT <= value.adjusted() <= DYNAMODB_MAX_EXPONENT:
+        return None
+    return value
+
+# ISO calendar date, the form the date indexes and YYYY-MM totals keys rely on
+DATE_PATTERN = re.compile(r'[0-9]{4}-[0-9]{2}-[0-9]{2}')
+
+def parse_date(value):
+    """The value if it is a real YYYY-MM-DD date string, None for anything else"""
+    if not isinstance(value, str) or not DATE_PATTERN.fullmatch(value):
+        return None
+    try:
+        date.fromisoformat(value)
+    except ValueError:
+        return None
+    return value
+
+def bad_request(message):
+    """400 response for a malformed request body"""
+    return {
+        'statusCode': 400,
+        'body': to_json({'error': message})
+    }
+
+# Caller identity pulled from the API Gateway event
+RequestContext = namedtuple('RequestContext', 'user_id email request_id')
+
+def extract_context(event):
+    """Extract the Cognito user and API Gateway request id from an event"""
+    request_context = event['requestContext']
+    claims = request_context['authorizer']['claims']
+    return RequestContext(claims['sub'], claims.get('email'), request_context.get('requestId'))
+
+# DynamoDB error codes that mean "slow down" rather than "broken"
+THROTTLING_ERROR_CODES = (
+    'ProvisionedThroughputExceededException',
+    'ThrottlingException',
+    'RequestLimitExceeded'
+)
+
+def throttled_response():
+    """429 response telling the client to back off and retry"""
+    return {
+        'statusCode': 429,
+        'headers': {'Retry-After': '1'},
+        'body': to_json({'error': 'Too many requests, please retry shortly'})
+    }
+
+# Per-item reasons a cancelled TransactWriteItems reports for throttling
+THROTTLING_CANCELLATION_CODES = ('ThrottlingError', 'ProvisionedThroughputExceeded')
+
+def is_throttled(e):
+    """True if e is a DynamoDB error asking the caller to slow down"""
+    if not isinstance(e, ClientError):
+        return False
+    code = e.response['Error']['Code']
+    if code == 'TransactionCanceledException':
+        return any(reason.get('Code') in THROTTLING_CANCELLATION_CODES
+                   for reason in e.response.get('CancellationReasons', []))
+    return code in THROTTLING_ERROR_CODES
+
+def error_response(e, message, error=None):
+    """429 for throttling, otherwise log the traceback and return a 500"""
+    if is_throttled(e):
+        logger.warning("%s: throttled (%s)", message, e.response['Error']['Code'])
+        return throttled_response()
+    logger.error("%s: %s", message, str(e), exc_info=True)
+    return {
+        'statusCode': 500,
+        'body': to_json({'error': str(e) if error is None else error})
+    }
@@ -1,115 +1,166 @@
 import json
 import boto3
+from boto3.dynamodb.conditions import Key, Attr
+from botocore.exceptions import ClientError
 import uuid
+from concurrent.futures import ThreadPoolExecutor
 import os
 from datetime import datetime
+from zoneinfo import ZoneInfo
 import decimal
 import logging
-import pytz
+
+from common import (bad_request, boto_config, error_response, extract_context, is_throttled,
+                    parse_amount, parse_date, to_attribute_values, to_json)
 
 # Configure logging
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
-# Helper class for JSON serialization of Decimal types
-class DecimalEncoder(json.JSONEncoder):
-    def default(self, o):
-        if isinstance(o, decimal.Decimal):
-            return float(o) if o % 1 != 0 else int(o)
-        return super(DecimalEncoder, self).default(o)
+# India Standard Time, resolved once per container
+IST = ZoneInfo('Asia/Kolkata')
 
 # Initialize DynamoDB resource
-dynamodb = boto3.resource('dynamodb')
+dynamodb = boto3.resource('dynamodb', config=boto_config)
 transactions_table = dynamodb.Table(os.environ['TRANSACTIONS_TABLE'])
 budgets_table = dynamodb.Table(os.environ['BUDGETS_TABLE'])
-sns = boto3.client('sns')
+totals_table = dynamodb.Table(os.environ['TOTALS_TABLE'])
+user_meta_table = dynamodb.Table(os.environ['USER_META_TABLE'])
+ses = boto3.client('ses', config=boto_config)
+SES_SENDER_EMAIL = os.environ['SES_SENDER_EMAIL']
+
+# Lets check_budget overlap its budget lookup with the monthly total read
+executor = ThreadPoolExecutor(max_workers=2)
 
 def create_transaction(event, context):
     """Create a new transaction and check budget status"""
-    logger.info("Starting create_transaction with event: %s", json.dumps(event))
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Event: %s", to_json(event))
 
     try:
-        # Parse request body
-        body = json.loads(event['body'])
-        # logger.debug("Request body: %s", json.dumps(body))
+        ctx = extract_context(event)
+        logger.info("handler=%s requestId=%s user=%s", 'create_transaction', ctx.request_id, ctx.user_id)
+
+        # Parse request body, reading numbers straight into Decimal
+        body = json.loads(event['body'], parse_float=decimal.Decimal, parse_int=decimal.Decimal)
 
-        # Get user ID from Cognito authorizer
-        user_id = event['requestContext']['authorizer']['claims']['sub']
-        # Get user email from Cognito claims
-        user_email = event['requestContext']['authorizer']['claims']['email']
-        # logger.info("Processing transaction for user: %s", user_id)
+        user_id = ctx.user_id
+        user_email = ctx.email
+
+        amount = parse_amount(body.get('amount'))
+        if amount is None:
+            return bad_request("'amount' must be a number")
+
+        # Category and date end up in index keys and the monthly totals key
+        category = body.get('category')
+        if not isinstance(category, str) or not category:
+            return bad_request("'category' must be a non-empty string")
 
         # Get current time in IST
-        ist_timezone = pytz.timezone('Asia/Kolkata')
-        now = datetime.now(ist_timezone)
+        now = datetime.now(IST)
+        current_month = f'{now.year:04d}-{now.month:02d}'
+
+        date = parse_date(body['date']) if body.get('date') else now.date().isoformat()
+        if date is None:
+            return bad_request("'date' must be a YYYY-MM-DD date")
 
         # Use IST timestamp for transaction creation
         transaction = {
             'userId': user_id,
             'transactionId': str(uuid.uuid4()),
-            'amount': decimal.Decimal(str(body.get('amount'))),
-            'category': body.get('category'),
+            'amount': amount,
+            'category': category,
             'description': body.get('description'),
-            'date': body.get('date') or now.strftime('%Y-%m-%d'),
-            'createdAt': now.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'date': date,
+            'createdAt': now.replace(microsecond=0).isoformat(),
             'paymentMethod': body.get('paymentMethod', 'other'),
         }
-        # logger.debug("Prepared transaction: %s", json.dumps(transaction, cls=DecimalEncoder))
 
-        # Store transaction in DynamoDB
-        transactions_table.put_item(Item=transaction)
-        # logger.info("Transaction stored successfully with ID: %s", transaction_id)
+        # Store the transaction, add it to its monthly per-category total and
+        # bump the user's transaction version and write time (so cached
+        # analytics go stale) in one transaction. Nothing below this write may fail the request: a 429
+        # from here means nothing was stored and the client can safely retry.
+        dynamodb.meta.client.transact_write_items(
+            TransactItems=[
+                {
+                    'Put': {
+                        'TableName': transactions_table.name,
+                        'Item': to_attribute_values(transaction)
+                    }
+                },
+                {
+                    'Update': {
+                        'TableName': totals_table.name,
+                        'Key': to_attribute_values({
+                            'userId': user_id,
+                            'ymCat': f"{transaction['date'][:7]}#{transaction['category']}"
+                        }),
+                        'UpdateExpression': 'ADD #tot :amt',
+                        'ExpressionAttributeNames': {'#tot': 'total'},
+                        'ExpressionAttributeValues': to_attribute_values({':amt': transaction['amount']})
+                    }
+                },
+                {
+                    'Update': {
+                        'TableName': user_meta_table.name,
+                        'Key': to_attribute_values({'userId': user_id}),
+                        'UpdateExpression': 'ADD txnVersion :one SET lastTxnAt = :at',
+                        'ExpressionAttributeValues': to_attribute_values({
+                            ':one': 1,
+                            ':at': int(now.timestamp() * 1000)  # epoch milliseconds
+                        })
+                    }
+                }
+            ]
+        )
 
-        # Check budget status - pass user email for SES
-        check_budget(user_id, body['category'], body['amount'], user_email)
-        logger.info("Budget check completed for category: %s", body['category'])
+        # Only transactions dated this month can change this month's budget status,
+        # and without an email claim there is nowhere to send an alert
+        if user_email is None:
+            logger.warning("No email claim for user %s, skipping budget check", user_id)
+        elif transaction['date'][:7] == current_month:
+            # Check budget status - pass user email for SES
+            check_budget(user_id, transaction['category'], user_email, current_month)
+            logger.info("Budget check completed for category: %s", transaction['category'])
 
         return {
             'statusCode': 201,
             'headers': {
                 'Content-Type': 'application/json'
             },
-            'body': json.dumps({
+            'body': to_json({
                 'message': 'Transaction created successfully',
                 'transactionId': transaction['transactionId']
             })
         }
     except Exception as e:
-        logger.error("Error creating transaction: %s", str(e), exc_info=True)
-        return {
-            'statusCode': 500,
-            'body': json.dumps({
-                'error': str(e)
-            })
-        }
+        return error_response(e, "Error creating transaction")
 
 def get_transactions(event, context):
     """Get transactions for a user with optional filtering"""
-    logger.info("Starting get_transactions with event: %s", json.dumps(event))
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Event: %s", to_json(event))
 
     try:
-        # Get user ID from Cognito authorizer
-        user_id = event['requestContext']['authorizer']['claims']['sub']
-        logger.info("Retrieving transactions for user: %s", user_id)
+        ctx = extract_context(event)
+        logger.info("handler=%s requestId=%s user=%s", 'get_transactions', ctx.request_id, ctx.user_id)
+
+        user_id = ctx.user_id
 
         # Get query parameters
         params = event.get('queryStringParameters', {}) or {}
-        logger.debug("Query parameters: %s", json.dumps(params))
+        logger.debug("Query parameters: %s", params)
 
         # Update default date range to use IST
-        ist_timezone = pytz.timezone('Asia/Kolkata')
-        now = datetime.now(ist_timezone)
+        now = datetime.now(IST)
 
-        start_date = params.get('startDate', now.strftime('%Y-%m-01'))
-        end_date = params.get('endDate', now.strftime('%Y-%m-%d'))
+        start_date = params.get('startDate', f'{now.year:04d}-{now.month:02d}-01')
+        end_date = params.get('endDate', now.date().isoformat())
         logger.info("Fetching transactions from %s to %s (IST)", start_date, end_date)
 
         # Prepare query
+        key_condition = Key('userId').eq(user_id)
         query_params = {
-            'KeyConditionExpression': 'userId = :uid',
-            'ExpressionAttributeValues': {
-                ':uid': user_id
-            },
             'ScanIndexForward': False  # Most recent first
         }
 
@@ -118,35 +169,36 @@ def get_transactions(event, context):
             logger.info("Filtering by category: %s", params['category'])
             # Use the category index
             query_params['IndexName'] = 'CategoryIndex'
-            query_params['KeyConditionExpression'] = 'userId = :uid AND category = :cat'
-            query_params['ExpressionAttributeValues'][':cat'] = params['category']
+            key_condition &= Key('category').eq(params['category'])
+            # Category index is keyed on category, so date stays a filter
+            date_attr = Attr('date')
+        else:
+            date_attr = Key('date')
 
         # Handle date filtering
-        if 'startDate' in params:
-            start_date = params['startDate']
+        if 'startDate' in params and 'endDate' in params:
+            logger.info("Filtering by date range: %s to %s", start_date, end_date)
+            date_condition = date_attr.between(start_date, end_date)
+        elif 'startDate' in params:
             logger.info("Filtering by start date: %s", start_date)
-            # Add filter for dates
-            filter_expr = 'date >= :start'
-            query_params['ExpressionAttributeValues'][':start'] = start_date
-
-            if 'FilterExpression' in query_params:
-                query_params['FilterExpression'] += f' AND {filter_expr}'
-            else:
-                query_params['FilterExpression'] = filter_expr
-
-        if 'endDate' in params:
-            end_date = params['endDate']
+            date_condition = date_attr.gte(start_date)
+        elif 'endDate' in params:
             logger.info("Filtering by end date: %s", end_date)
-            # Add filter for dates
-            filter_expr = 'date <= :end'
-            query_params['ExpressionAttributeValues'][':end'] = end_date
+            date_condition = date_attr.lte(end_date)
+        else:
+            date_condition = None
 
-            if 'FilterExpression' in query_params:
-                query_params['FilterExpression'] += f' AND {filter_expr}'
+        if date_condition is not None:
+            if 'IndexName' in query_params:
+                query_params['FilterExpression'] = date_condition
             else:
-                query_params['FilterExpression'] = filter_expr
+                # Use the date index so only the matching range is read
+                query_params['IndexName'] = 'DateIndex'
+                key_condition &= date_condition
 
-        logger.debug("Final query parameters: %s", json.dumps(query_params))
+        query_params['KeyConditionExpression'] = key_condition
+
+        logger.debug("Final query parameters: %s", query_params)
 
         # Execute query
         response = transactions_table.query(**query_params)
@@ -158,26 +210,33 @@ def get_transactions(event, context):
             'headers': {
                 'Content-Type': 'application/json'
             },
-            'body': json.dumps({
+            'body': to_json({
                 'transactions': response.get('Items', []),
                 'count': item_count,
                 'lastEvaluatedKey': response.get('LastEvaluatedKey')
-            }, cls=DecimalEncoder)
-        }
-    except Exception as e:
-        logger.error("Error retrieving transactions: %s", str(e), exc_info=True)
-        return {
-            'statusCode': 500,
-            'body': json.dumps({
-                'error': str(e)
             })
         }
+    except Exception as e:
+        return error_response(e, "Error retrieving transactions")
 
-def check_budget(user_id, category, amount, user_email):
-    """Check if a transaction exceeds the user's budget"""
-    logger.info("Checking budget for user %s, category %s, amount %s", user_id, category, amount)
+def check_budget(user_id, category, user_email, current_month):
+    """Check if the month's spending in a category exceeds the user's budget"""
+    logger.info("Checking budget for user %s, category %s, month %s (IST)", user_id, category, current_month)
 
     try:
+        # Month's spend in this category, including the transaction just written;
+        # independent of the budget lookup, so fetch both concurrently
+        totals_future = executor.submit(
+            totals_table.get_item,
+            Key={
+                'userId': user_id,
+                'ymCat': f'{current_month}#{category}'
+            },
+            ProjectionExpression='#tot',
+            ExpressionAttributeNames={'#tot': 'total'},
+            ConsistentRead=True
+        )
+
         # Get budget for this category
         response = budgets_table.get_item(
             Key={
@@ -185,6 +244,8 @@ def check_budget(user_id, category, amount, user_email):
                 'category': category
             }
         )
+        # Settle both reads before returning so none outlives the invocation
+        totals = totals_future.result()
 
         # If no budget exists, return
         if 'Item' not in response:
@@ -193,42 +254,26 @@ def check_budget(user_id, category, amount, user_email):
 
         budget = response['Item']
         budget_limit = budget['limit']
-        logger.debug("Found budget: %s", json.dumps(budget, cls=DecimalEncoder))
-
-        # Use IST timezone for current month calculation
-        ist_timezone = pytz.timezone('Asia/Kolkata')
-        now = datetime.now(ist_timezone)
-        current_month = now.strftime('%Y-%m')
-        logger.info("Checking budget for month: %s (IST)", current_month)
-
-        # Query transactions in this category for current month
-        response = transactions_table.query(
-            IndexName='CategoryIndex',
-            KeyConditionExpression='userId = :uid AND category = :cat',
-            FilterExpression='begins_with(#dt, :month)',
-            ExpressionAttributeNames={
-                '#dt': 'date'
-            },
-            ExpressionAttributeValues={
-                ':uid': user_id,
-                ':cat': category,
-                ':month': current_month
-            }
-        )
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Found budget: %s", to_json(budget))
 
-        # Calculate total spent
-        total_spent = sum(item['amount'] for item in response.get('Items', []))
-        # logger.info("Total spent in %s for category %s: %s", current_month, category, total_spent)
+        # Nothing left to do once this month's alert has gone out
+        if budget.get('alertSent', {}).get(current_month):
+            logger.info("Budget alert already sent for category %s in %s", category, current_month)
+            return
+
+        total_spent = totals.get('Item', {}).get('total', decimal.Decimal('0'))
 
         # Check if budget exceeded
         if total_spent > budget_limit:
             logger.warning("Budget exceeded for category %s. Spent: %s, Limit: %s", category, total_spent, budget_limit)
 
-            # Get SES client
-            ses = boto3.client('ses')
+            # Only the invocation that flags the month sends the email
+            if not claim_budget_alert(user_id, category, current_month):
+                logger.info("Budget alert for category %s in %s already claimed", category, current_month)
+                return
 
             # Prepare email content
-            sender_email = os.environ['SES_SENDER_EMAIL']
             subject = 'MoneyMinder Budget Alert'
             body_text = f"Budget Alert: You've spent ${total_spent} on {category}, exceeding your budget of ${budget_limit}"
             body_html = f"""
@@ -246,7 +291,7 @@ def check_budget(user_id, category, amount, user_email):
             # Send email using SES
             try:
                 response = ses.send_email(
-                    Source=sender_email,
+                    Source=SES_SENDER_EMAIL,
                     Destination={
                         'ToAddresses': [user_email]
                     },
@@ -267,19 +312,61 @@ def check_budget(user_id, category, amount, user_email):
                 logger.info("Budget alert email sent with MessageId: %s", response['MessageId'])
             except Exception as e:
                 logger.error("Error sending email: %s", str(e))
+                # Give the next transaction a chance to send this month's alert
+                release_budget_alert(user_id, category, current_month)
+
+    except Exception as e:
+        if is_throttled(e):
+            logger.warning("Throttled checking budget: %s", e.response['Error']['Code'])
+        else:
+            logger.error("Error checking budget: %s", str(e), exc_info=True)
+
+def claim_budget_alert(user_id, category, month):
+    """Atomically flag the month's budget alert as sent, returning True if this call set it"""
+    key = {
+        'userId': user_id,
+        'category': category
+    }
 
-            # Update budget item with alert status
-            # budgets_table.update_item(
-            #     Key={
-            #         'userId': user_id,
-            #         'category': category
-            #     },
-            #     UpdateExpression='SET alertSent = :val',
-            #     ExpressionAttributeValues={
-            #         ':val': True
-            #     }
-            # )
-            # logger.info("Budget alert status updated")
+    try:
+        budgets_table.update_item(
+            Key=key,
+            UpdateExpression='SET alertSent.#ym = :sent',
+            ConditionExpression='attribute_exists(alertSent) AND attribute_not_exists(alertSent.#ym)',
+            ExpressionAttributeNames={'#ym': month},
+            ExpressionAttributeValues={':sent': True}
+        )
+        return True
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+            raise
 
+    # Either the flag is already set, or the budget predates the alertSent map
+    try:
+        budgets_table.update_item(
+            Key=key,
+            UpdateExpression='SET alertSent = :sent',
+            ConditionExpression='attribute_exists(userId) AND attribute_not_exists(alertSent)',
+            ExpressionAttributeValues={':sent': {month: True}}
+        )
+        return True
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+            raise
+        return False
+
+def release_budget_alert(user_id, category, month):
+    """Clear the month's alert flag after a failed send so a later check can retry"""
+    try:
+        budgets_table.update_item(
+            Key={
+                'userId': user_id,
+                'category': category
+            },
+            UpdateExpression='REMOVE alertSent.#ym',
+            ConditionExpression='attribute_exists(userId)',
+            ExpressionAttributeNames={'#ym': month}
+        )
+        logger.info("Released budget alert for category %s in %s", category, month)
     except Exception as e:
-        logger.error("Error checking budget: %s", str(e), exc_info=True)
\ No newline at end of file
+        logger.error("Error releasing budget alert: %s", str(e))
@@ -0,0 +1,68 @@
+"""One-off backfill of MonthlyCategoryTotals from the existing transactions.
+
+create_transaction only maintains totals for transactions written after the
+totals table was introduced. Run this once right after deploying it:
+
+    python scripts/backfill_monthly_totals.py \
+        --transactions-table <TransactionsTable> \
+        --totals-table <MonthlyCategoryTotalsTable>
+
+Each total is recomputed from a full scan and written with SET, so the script
+is safe to re-run. A transaction created while the scan is in flight can be
+overwritten by the recomputed total; re-running once traffic is quiet
+converges every row to the true sum.
+"""
+import argparse
+import logging
+from collections import Counter
+
+import boto3
+
+logger = logging.getLogger(__name__)
+
+
+def scan_totals(transactions_table):
+    """Sum every transaction amount by (userId, 'YYYY-MM#category')"""
+    totals = Counter()
+    scan_params = {
+        'ProjectionExpression': 'userId, #dt, category, amount',
+        'ExpressionAttributeNames': {'#dt': 'date'}
+    }
+    while True:
+        response = transactions_table.scan(**scan_params)
+        for item in response.get('Items', []):
+            totals[(item['userId'], f"{item['date'][:7]}#{item['category']}")] += item['amount']
+        last_key = response.get('LastEvaluatedKey')
+        if not last_key:
+            return totals
+        scan_params['ExclusiveStartKey'] = last_key
+
+
+def write_totals(totals_table, totals):
+    """Overwrite each monthly category total with its recomputed value"""
+    for (user_id, ym_cat), total in totals.items():
+        totals_table.update_item(
+            Key={'userId': user_id, 'ymCat': ym_cat},
+            UpdateExpression='SET #tot = :total',
+            ExpressionAttributeNames={'#tot': 'total'},
+            ExpressionAttributeValues={':total': total}
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--transactions-table', required=True)
+    parser.add_argument('--totals-table', required=True)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    dynamodb = boto3.resource('dynamodb')
+
+    totals = scan_totals(dynamodb.Table(args.transactions_table))
+    logger.info("Computed %d monthly category totals", len(totals))
+    write_totals(dynamodb.Table(args.totals_table), totals)
+    logger.info("Backfill complete")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,15 @@
+import os
+import sys
+
+# Handlers read their table names at import time and import `common` flat,
+# the way Lambda loads them from the functions/ code root
+os.environ.setdefault('TRANSACTIONS_TABLE', 'Transactions')
+os.environ.setdefault('BUDGETS_TABLE', 'Budgets')
+os.environ.setdefault('TOTALS_TABLE', 'MonthlyCategoryTotals')
+os.environ.setdefault('USER_META_TABLE', 'UserMeta')
+os.environ.setdefault('SES_SENDER_EMAIL', 'alerts@example.com')
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+os.environ.setdefault('AWS_ACCESS_KEY_ID', 'testing')
+os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'testing')
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', 'functions'))
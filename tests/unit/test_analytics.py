@@ -0,0 +1,220 @@
+import json
+from datetime import datetime
+
+import pytest
+from botocore.stub import ANY, Stubber
+
+import analytics
+
+
+@pytest.fixture()
+def ddb_stub(monkeypatch):
+    """Stubs the client behind the module's DynamoDB tables, without retry backoff"""
+    monkeypatch.setattr(analytics.time, 'sleep', lambda seconds: None)
+    with Stubber(analytics.dynamodb.meta.client) as stubber:
+        yield stubber
+        stubber.assert_no_pending_responses()
+
+
+@pytest.fixture()
+def apigw_event():
+    """ Generates API GW Event for a spending query"""
+
+    return {
+        "requestContext": {
+            "requestId": "c6af9ac6-7b61-11e6-9a41-93e8deadbeef",
+            "authorizer": {"claims": {"sub": "user-1", "email": "user@example.com"}},
+        },
+        "queryStringParameters": {"startDate": "2024-05-01", "endDate": "2024-05-31"},
+        "headers": {},
+    }
+
+
+@pytest.fixture()
+def may_2024(monkeypatch):
+    """Pins the handlers' clock to 20 May 2024"""
+
+    class FixedDatetime(datetime):
+        @classmethod
+        def now(cls, tz=None):
+            return cls(2024, 5, 20, 12, 0, tzinfo=tz)
+
+    monkeypatch.setattr(analytics, 'datetime', FixedDatetime)
+
+
+def expect_versions(stubber, txn_version, budget_version=0, last_txn_at=0):
+    stubber.add_response('get_item', {'Item': {
+        'txnVersion': {'N': str(txn_version)},
+        'budgetVersion': {'N': str(budget_version)},
+        'lastTxnAt': {'N': str(last_txn_at)},
+    }}, {
+        'TableName': 'UserMeta',
+        'Key': {'userId': 'user-1'},
+        'ProjectionExpression': 'txnVersion, budgetVersion, lastTxnAt',
+        'ConsistentRead': True,
+    })
+
+
+def expect_spending_query(stubber):
+    stubber.add_response('query', {'Items': [
+        {'category': {'S': 'food'}, 'amount': {'N': '12.5'}},
+        {'category': {'S': 'food'}, 'amount': {'N': '7.5'}},
+    ]}, {
+        'TableName': 'Transactions',
+        'IndexName': 'DateIndex',
+        'KeyConditionExpression': ANY,
+        'ProjectionExpression': '#c, #a',
+        'ExpressionAttributeNames': {'#c': 'category', '#a': 'amount'},
+    })
+
+
+def test_etag_matches_if_none_match_case_insensitively():
+    event = {"headers": {"if-none-match": 'W/"other", "abc"'}}
+
+    assert analytics.etag_matches(event, '"abc"')
+    assert not analytics.etag_matches(event, '"xyz"')
+    assert not analytics.etag_matches({"headers": None}, '"abc"')
+
+
+def test_analyze_spending_returns_etag(ddb_stub, apigw_event):
+    expect_versions(ddb_stub, 3)
+    expect_spending_query(ddb_stub)
+
+    ret = analytics.analyze_spending(apigw_event, "")
+    data = json.loads(ret["body"])
+
+    assert ret["statusCode"] == 200
+    assert ret["headers"]["ETag"] == analytics.compute_etag("user-1", "2024-05-01", "2024-05-31", 3)
+    assert data["spendingByCategory"] == {"food": 20}
+    assert data["totalSpent"] == 20
+
+
+def test_analyze_spending_not_modified_skips_query(ddb_stub, apigw_event):
+    etag = analytics.compute_etag("user-1", "2024-05-01", "2024-05-31", 3)
+    apigw_event["headers"] = {"If-None-Match": etag}
+    expect_versions(ddb_stub, 3)
+
+    ret = analytics.analyze_spending(apigw_event, "")
+
+    assert ret == {"statusCode": 304, "headers": {"ETag": etag}, "body": ""}
+
+
+def test_analyze_spending_new_transaction_changes_etag(ddb_stub, apigw_event):
+    apigw_event["headers"] = {"If-None-Match": analytics.compute_etag("user-1", "2024-05-01", "2024-05-31", 3)}
+    expect_versions(ddb_stub, 4)
+    expect_spending_query(ddb_stub)
+
+    ret = analytics.analyze_spending(apigw_event, "")
+
+    assert ret["statusCode"] == 200
+    assert ret["headers"]["ETag"] == analytics.compute_etag("user-1", "2024-05-01", "2024-05-31", 4)
+
+
+def test_analyze_spending_omits_etag_until_index_settles(ddb_stub, apigw_event):
+    expect_versions(ddb_stub, 4, last_txn_at=int(analytics.time.time() * 1000))
+    expect_spending_query(ddb_stub)
+
+    ret = analytics.analyze_spending(apigw_event, "")
+
+    assert ret["statusCode"] == 200
+    assert "ETag" not in ret["headers"]
+
+
+def expect_budget_status_reads(stubber, limit, total):
+    stubber.add_response('query', {'Items': [
+        {'userId': {'S': 'user-1'}, 'category': {'S': 'food'}, 'limit': {'N': limit}},
+    ]}, {
+        'TableName': 'Budgets',
+        'KeyConditionExpression': ANY,
+        'ConsistentRead': True,
+    })
+    stubber.add_response('batch_get_item', {
+        'Responses': {'MonthlyCategoryTotals': [total_item('food', total)]}
+    }, {'RequestItems': {'MonthlyCategoryTotals': {
+        'Keys': [total_key('food')],
+        'ProjectionExpression': 'ymCat, #tot',
+        'ExpressionAttributeNames': {'#tot': 'total'},
+        'ConsistentRead': True,
+    }}})
+
+
+def test_budget_status_new_budget_version_returns_new_data(ddb_stub, apigw_event, may_2024):
+    expect_versions(ddb_stub, 3, 1)
+    expect_budget_status_reads(ddb_stub, '100', '50')
+
+    first = analytics.budget_status(apigw_event, "")
+
+    assert first["statusCode"] == 200
+    assert json.loads(first["body"])["budgetStatus"][0]["limit"] == 100
+
+    apigw_event["headers"] = {"If-None-Match": first["headers"]["ETag"]}
+    expect_versions(ddb_stub, 3, 2)
+    expect_budget_status_reads(ddb_stub, '200', '50')
+
+    second = analytics.budget_status(apigw_event, "")
+    data = json.loads(second["body"])
+
+    assert second["statusCode"] == 200
+    assert second["headers"]["ETag"] == analytics.compute_etag("user-1", "2024-05", 3, 2)
+    assert second["headers"]["ETag"] != first["headers"]["ETag"]
+    assert data["month"] == "2024-05"
+    assert data["budgetStatus"] == [{
+        "category": "food", "limit": 200, "spent": 50, "remaining": 150, "percentageUsed": 25
+    }]
+
+
+def test_budget_status_not_modified_skips_reads(ddb_stub, apigw_event, may_2024):
+    etag = analytics.compute_etag("user-1", "2024-05", 3, 2)
+    apigw_event["headers"] = {"If-None-Match": etag}
+    expect_versions(ddb_stub, 3, 2)
+
+    assert analytics.budget_status(apigw_event, "") == {"statusCode": 304, "headers": {"ETag": etag}, "body": ""}
+
+
+def total_key(category):
+    return {'userId': 'user-1', 'ymCat': f'2024-05#{category}'}
+
+
+def total_item(category, amount):
+    return {'userId': {'S': 'user-1'}, 'ymCat': {'S': f'2024-05#{category}'}, 'total': {'N': amount}}
+
+
+def test_batch_get_all_chunks_keys_by_100(ddb_stub):
+    keys = [total_key(f'c{i}') for i in range(150)]
+    for chunk in (keys[:100], keys[100:]):
+        ddb_stub.add_response('batch_get_item', {'Responses': {'MonthlyCategoryTotals': []}},
+                              {'RequestItems': {'MonthlyCategoryTotals': {'Keys': chunk}}})
+
+    assert analytics.batch_get_all(analytics.totals_table, keys) == []
+
+
+def test_batch_get_all_retries_unprocessed_keys(ddb_stub):
+    keys = [total_key('food'), total_key('rent')]
+    ddb_stub.add_response('batch_get_item', {
+        'Responses': {'MonthlyCategoryTotals': [total_item('food', '12.5')]},
+        'UnprocessedKeys': {'MonthlyCategoryTotals': {'Keys': [
+            {'userId': {'S': 'user-1'}, 'ymCat': {'S': '2024-05#rent'}}
+        ]}}
+    })
+    ddb_stub.add_response('batch_get_item', {
+        'Responses': {'MonthlyCategoryTotals': [total_item('rent', '900')]}
+    }, {'RequestItems': {'MonthlyCategoryTotals': {'Keys': [total_key('rent')]}}})
+
+    items = analytics.batch_get_all(analytics.totals_table, keys)
+
+    assert [(i['ymCat'], i['total']) for i in items] == [
+        ('2024-05#food', analytics.decimal.Decimal('12.5')),
+        ('2024-05#rent', analytics.decimal.Decimal('900')),
+    ]
+
+
+def test_batch_get_all_gives_up_after_max_attempts(ddb_stub):
+    for _ in range(analytics.MAX_BATCH_ATTEMPTS):
+        ddb_stub.add_response('batch_get_item', {'Responses': {}, 'UnprocessedKeys': {
+            'MonthlyCategoryTotals': {'Keys': [{'userId': {'S': 'user-1'}, 'ymCat': {'S': '2024-05#food'}}]}
+        }})
+
+    with pytest.raises(analytics.ClientError) as excinfo:
+        analytics.batch_get_all(analytics.totals_table, [total_key('food')])
+
+    assert excinfo.value.response['Error']['Code'] == 'ProvisionedThroughputExceededException'
@@ -0,0 +1,68 @@
+import json
+from datetime import datetime
+
+import pytest
+from botocore.stub import Stubber
+
+import budgets
+
+
+@pytest.fixture()
+def ddb_stub():
+    """Stubs the client behind the module's DynamoDB tables"""
+    with Stubber(budgets.dynamodb.meta.client) as stubber:
+        yield stubber
+        stubber.assert_no_pending_responses()
+
+
+def create_event(body):
+    return {
+        "requestContext": {
+            "requestId": "c6af9ac6-7b61-11e6-9a41-93e8deadbeef",
+            "authorizer": {"claims": {"sub": "user-1", "email": "user@example.com"}},
+        },
+        "body": body,
+    }
+
+
+@pytest.mark.parametrize("body", [
+    '{"category": "food"}',
+    '{"category": "food", "limit": "lots"}',
+    '{"category": "food", "limit": false}',
+    '{"category": "food", "limit": 1e400}',
+])
+def test_create_budget_rejects_bad_limit(ddb_stub, body):
+    ret = budgets.create_budget(create_event(body), "")
+
+    assert ret["statusCode"] == 400
+    assert json.loads(ret["body"]) == {"error": "'limit' must be a number"}
+
+
+def test_create_budget_writes_budget_and_version_together(ddb_stub, monkeypatch):
+    class FixedDatetime(datetime):
+        @classmethod
+        def now(cls, tz=None):
+            return cls(2024, 5, 20, 12, 0, 0, 123, tzinfo=tz)
+
+    monkeypatch.setattr(budgets, 'datetime', FixedDatetime)
+    ddb_stub.add_response('transact_write_items', {}, {'TransactItems': [
+        {'Put': {'TableName': 'Budgets', 'Item': {
+            'userId': {'S': 'user-1'},
+            'category': {'S': 'food'},
+            'limit': {'N': '250.5'},
+            'alertSent': {'M': {}},
+            'createdAt': {'S': '2024-05-20T12:00:00+05:30'},
+            'updatedAt': {'S': '2024-05-20T12:00:00+05:30'},
+        }}},
+        {'Update': {
+            'TableName': 'UserMeta',
+            'Key': {'userId': {'S': 'user-1'}},
+            'UpdateExpression': 'ADD budgetVersion :one',
+            'ExpressionAttributeValues': {':one': {'N': '1'}},
+        }},
+    ]})
+
+    ret = budgets.create_budget(create_event('{"category": "food", "limit": 250.5}'), "")
+
+    assert ret["statusCode"] == 201
+    assert json.loads(ret["body"])["category"] == "food"
@@ -0,0 +1,78 @@
+from decimal import Decimal
+
+import pytest
+
+import common
+
+
+@pytest.mark.parametrize("value, expected", [
+    (Decimal("12"), "12"),
+    (Decimal("12.50"), "12.5"),
+    (Decimal("123456789012345678"), "123456789012345678"),
+    (Decimal("-9223372036854775808"), "-9223372036854775808"),
+    (Decimal("1E+20"), "1e20"),
+    (Decimal("-1E+20"), "-1e20"),
+])
+def test_to_json_decimal(value, expected):
+    assert common.to_json({"a": value}) == '{"a":%s}' % expected
+
+
+def test_decimal_default_rejects_other_types():
+    with pytest.raises(TypeError):
+        common.decimal_default(object())
+
+
+@pytest.mark.parametrize("value, expected", [
+    ("2024-05-03", "2024-05-03"),
+    ("2024-5-3", None),
+    ("20240503", None),
+    ("2024-02-30", None),
+    (20240503, None),
+    (None, None),
+])
+def test_parse_date(value, expected):
+    assert common.parse_date(value) == expected
+
+
+@pytest.mark.parametrize("value, expected", [
+    (Decimal("12.5"), Decimal("12.5")),
+    ("12.5", Decimal("12.5")),
+    (Decimal("0"), Decimal("0")),
+    (Decimal("9.9E+125"), Decimal("9.9E+125")),
+    (Decimal("1E-130"), Decimal("1E-130")),
+    (Decimal("1E+126"), None),
+    (Decimal("1E-131"), None),
+    (Decimal("1E+400"), None),
+    (Decimal("1." + "1" * 38), None),
+    (Decimal("NaN"), None),
+    ("Infinity", None),
+    ("ten", None),
+    (True, None),
+    (None, None),
+    (10.5, None),
+])
+def test_parse_amount(value, expected):
+    assert common.parse_amount(value) == expected
+
+
+def client_error(code, **fields):
+    return common.ClientError(dict({'Error': {'Code': code, 'Message': ''}}, **fields), 'TransactWriteItems')
+
+
+@pytest.mark.parametrize("error, expected", [
+    (client_error('ProvisionedThroughputExceededException'), True),
+    (client_error('ThrottlingException'), True),
+    (client_error('TransactionCanceledException',
+                  CancellationReasons=[{'Code': 'None'}, {'Code': 'ProvisionedThroughputExceeded'}]), True),
+    (client_error('TransactionCanceledException', CancellationReasons=[{'Code': 'ConditionalCheckFailed'}]), False),
+    (client_error('ValidationException'), False),
+    (ValueError('boom'), False),
+])
+def test_is_throttled(error, expected):
+    assert common.is_throttled(error) is expected
+
+
+def test_error_response_for_unexpected_errors():
+    ret = common.error_response(ValueError('boom'), "Error doing things")
+
+    assert ret == {'statusCode': 500, 'body': '{"error":"boom"}'}
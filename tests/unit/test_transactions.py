@@ -0,0 +1,205 @@
+import json
+
+import pytest
+from boto3.dynamodb.conditions import Attr, Key
+from botocore.stub import Stubber
+
+import transactions
+
+BUDGET_KEY = {'userId': 'user-1', 'category': 'food'}
+
+
+@pytest.fixture()
+def ddb_stub():
+    """Stubs the client behind the module's DynamoDB tables"""
+    with Stubber(transactions.dynamodb.meta.client) as stubber:
+        yield stubber
+        stubber.assert_no_pending_responses()
+
+
+def expect_set_month(stubber):
+    stubber.add_response('update_item', {}, {
+        'TableName': 'Budgets',
+        'Key': BUDGET_KEY,
+        'UpdateExpression': 'SET alertSent.#ym = :sent',
+        'ConditionExpression': 'attribute_exists(alertSent) AND attribute_not_exists(alertSent.#ym)',
+        'ExpressionAttributeNames': {'#ym': '2024-05'},
+        'ExpressionAttributeValues': {':sent': True},
+    })
+
+
+def expect_set_map(stubber):
+    stubber.add_response('update_item', {}, {
+        'TableName': 'Budgets',
+        'Key': BUDGET_KEY,
+        'UpdateExpression': 'SET alertSent = :sent',
+        'ConditionExpression': 'attribute_exists(userId) AND attribute_not_exists(alertSent)',
+        'ExpressionAttributeValues': {':sent': {'2024-05': True}},
+    })
+
+
+def fail_condition(stubber):
+    stubber.add_client_error('update_item', service_error_code='ConditionalCheckFailedException')
+
+
+def test_claim_budget_alert_sets_month(ddb_stub):
+    expect_set_month(ddb_stub)
+
+    assert transactions.claim_budget_alert('user-1', 'food', '2024-05') is True
+
+
+def test_claim_budget_alert_creates_map_for_legacy_budget(ddb_stub):
+    fail_condition(ddb_stub)
+    expect_set_map(ddb_stub)
+
+    assert transactions.claim_budget_alert('user-1', 'food', '2024-05') is True
+
+
+def test_claim_budget_alert_already_claimed(ddb_stub):
+    fail_condition(ddb_stub)
+    fail_condition(ddb_stub)
+
+    assert transactions.claim_budget_alert('user-1', 'food', '2024-05') is False
+
+
+def test_claim_budget_alert_raises_other_errors(ddb_stub):
+    ddb_stub.add_client_error('update_item', service_error_code='ProvisionedThroughputExceededException')
+
+    with pytest.raises(transactions.ClientError):
+        transactions.claim_budget_alert('user-1', 'food', '2024-05')
+
+
+@pytest.fixture()
+def apigw_event():
+    """ Generates API GW Event for a transactions listing"""
+
+    return {
+        "requestContext": {
+            "requestId": "c6af9ac6-7b61-11e6-9a41-93e8deadbeef",
+            "authorizer": {"claims": {"sub": "user-1", "email": "user@example.com"}},
+        },
+        "queryStringParameters": {},
+    }
+
+
+def expect_query(stubber, **query_params):
+    stubber.add_response('query', {'Items': [
+        {'transactionId': {'S': 't-1'}, 'amount': {'N': '12.5'}}
+    ]}, dict(query_params, TableName='Transactions', ScanIndexForward=False))
+
+
+def test_get_transactions_date_range_uses_date_index(ddb_stub, apigw_event):
+    apigw_event["queryStringParameters"] = {"startDate": "2024-05-01", "endDate": "2024-05-31"}
+    expect_query(
+        ddb_stub,
+        IndexName='DateIndex',
+        KeyConditionExpression=Key('userId').eq('user-1') & Key('date').between('2024-05-01', '2024-05-31')
+    )
+
+    ret = transactions.get_transactions(apigw_event, "")
+    data = json.loads(ret["body"])
+
+    assert ret["statusCode"] == 200
+    assert data["transactions"] == [{"transactionId": "t-1", "amount": 12.5}]
+    assert data["count"] == 1
+
+
+def test_get_transactions_start_date_only(ddb_stub, apigw_event):
+    apigw_event["queryStringParameters"] = {"startDate": "2024-05-01"}
+    expect_query(
+        ddb_stub,
+        IndexName='DateIndex',
+        KeyConditionExpression=Key('userId').eq('user-1') & Key('date').gte('2024-05-01')
+    )
+
+    assert transactions.get_transactions(apigw_event, "")["statusCode"] == 200
+
+
+def test_get_transactions_category_filters_date(ddb_stub, apigw_event):
+    apigw_event["queryStringParameters"] = {"category": "food", "endDate": "2024-05-31"}
+    expect_query(
+        ddb_stub,
+        IndexName='CategoryIndex',
+        KeyConditionExpression=Key('userId').eq('user-1') & Key('category').eq('food'),
+        FilterExpression=Attr('date').lte('2024-05-31')
+    )
+
+    assert transactions.get_transactions(apigw_event, "")["statusCode"] == 200
+
+
+def test_get_transactions_without_filters_queries_table(ddb_stub, apigw_event):
+    expect_query(ddb_stub, KeyConditionExpression=Key('userId').eq('user-1'))
+
+    assert transactions.get_transactions(apigw_event, "")["statusCode"] == 200
+
+
+def create_event(body):
+    return {
+        "requestContext": {
+            "requestId": "c6af9ac6-7b61-11e6-9a41-93e8deadbeef",
+            "authorizer": {"claims": {"sub": "user-1", "email": "user@example.com"}},
+        },
+        "body": json.dumps(body),
+    }
+
+
+@pytest.mark.parametrize("body, error", [
+    ({"amount": "ten", "category": "food"}, "'amount' must be a number"),
+    ({"amount": True, "category": "food"}, "'amount' must be a number"),
+    ({"amount": "1e400", "category": "food"}, "'amount' must be a number"),
+    ({"amount": 10, "date": "2024-05-03"}, "'category' must be a non-empty string"),
+    ({"amount": 10, "category": "", "date": "2024-05-03"}, "'category' must be a non-empty string"),
+    ({"amount": 10, "category": 7, "date": "2024-05-03"}, "'category' must be a non-empty string"),
+    ({"amount": 10, "category": "food", "date": 20240503}, "'date' must be a YYYY-MM-DD date"),
+    ({"amount": 10, "category": "food", "date": "2024-5-3"}, "'date' must be a YYYY-MM-DD date"),
+    ({"amount": 10, "category": "food", "date": "2024-02-30"}, "'date' must be a YYYY-MM-DD date"),
+])
+def test_create_transaction_rejects_bad_fields(ddb_stub, body, error):
+    ret = transactions.create_transaction(create_event(body), "")
+
+    assert ret["statusCode"] == 400
+    assert json.loads(ret["body"]) == {"error": error}
+
+
+def cancelled_write(stubber, *reason_codes):
+    stubber.add_client_error(
+        'transact_write_items',
+        service_error_code='TransactionCanceledException',
+        modeled_fields={'CancellationReasons': [{'Code': code} for code in reason_codes]}
+    )
+
+
+def test_create_transaction_throttled_write_returns_429(ddb_stub):
+    cancelled_write(ddb_stub, 'None', 'ThrottlingError', 'None')
+
+    ret = transactions.create_transaction(create_event({"amount": 10, "category": "food"}), "")
+
+    assert ret["statusCode"] == 429
+    assert ret["headers"] == {"Retry-After": "1"}
+
+
+def test_create_transaction_throughput_exceeded_returns_429(ddb_stub):
+    ddb_stub.add_client_error('transact_write_items', service_error_code='ProvisionedThroughputExceededException')
+
+    ret = transactions.create_transaction(create_event({"amount": 10, "category": "food"}), "")
+
+    assert ret["statusCode"] == 429
+
+
+def test_create_transaction_cancelled_for_other_reasons_returns_500(ddb_stub):
+    cancelled_write(ddb_stub, 'None', 'ValidationError', 'None')
+
+    ret = transactions.create_transaction(create_event({"amount": 10, "category": "food"}), "")
+
+    assert ret["statusCode"] == 500
+
+
+def test_create_transaction_stored_then_throttled_check_still_201(ddb_stub):
+    ddb_stub.add_response('transact_write_items', {})
+    # check_budget's reads run concurrently, so either may meet the throttle
+    ddb_stub.add_client_error('get_item', service_error_code='ProvisionedThroughputExceededException')
+    ddb_stub.add_client_error('get_item', service_error_code='ProvisionedThroughputExceededException')
+
+    ret = transactions.create_transaction(create_event({"amount": 10, "category": "food"}), "")
+
+    assert ret["statusCode"] == 201